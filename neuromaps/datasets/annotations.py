@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 """Functions for fetching annotations (from the internet, if necessary)."""
 
-from collections import defaultdict
+from collections import namedtuple
+import functools
+import os
 from pathlib import Path
 import re
 import shutil
+from joblib import Parallel, delayed
+import numpy as np
 import pandas as pd
 import warnings
 
@@ -20,8 +24,16 @@ from neuromaps.datasets.utils import (
 )
 
 MATCH = re.compile(
-    r'source-(\S+)_desc-(\S+)_space-(\S+)_(?:den|res)-(\d+[k|m]{1,2})_'
+    r'(?:^|(?<=[/\\\n]))'
+    r'source-([^_\s]+)_desc-([^_\s]+)_space-([^_\s]+)_'
+    r'(?:den|res)-(\d+[km]{1,2})_',
+    re.ASCII
 )
+# columnar view of annotation info; see `_annot_table()`
+_AnnotTable = namedtuple('_AnnotTable', (
+    'source', 'desc', 'space', 'hemi', 'format', 'den', 'res', 'denres',
+    'tags', 'fname', 'rel_path', 'url', 'checksum', 'exact'
+))
 
 
 def _groupby_match(fnames, return_single=False):
@@ -42,11 +54,27 @@ def _groupby_match(fnames, return_single=False):
         Where keys are tuple (source, desc, space, res/den) and values are
         lists of filenames
     """
-    out = defaultdict(list)
-    for fn in fnames:
-        out[MATCH.search(fn).groups()].append(fn)
-
-    out = {k: v if len(v) > 1 else v[0] for k, v in out.items()}
+    # scan all filenames in a single call and map the match offsets back to
+    # their source filenames via the cumulative lengths of `fnames`
+    fnames = [str(fn) for fn in fnames]
+    matches = list(MATCH.finditer('\n'.join(fnames)))
+    ends = np.cumsum([len(fn) + 1 for fn in fnames])
+    idx = np.searchsorted(ends, [m.start() for m in matches], side='right')
+    counts = np.bincount(idx, minlength=len(fnames))
+    if np.any(counts != 1):
+        bad = [fnames[n] for n in np.flatnonzero(counts != 1)]
+        raise ValueError(f'Could not uniquely match filenames: {bad}')
+
+    out = {}
+    for fn, match in zip(fnames, matches):
+        key = match.groups()
+        val = out.get(key)
+        if val is None:
+            out[key] = fn
+        elif isinstance(val, list):
+            val.append(fn)
+        else:
+            out[key] = [val, fn]
 
     if return_single and len(out) == 1:
         out = list(out.values())[0]
@@ -54,16 +82,103 @@ def _groupby_match(fnames, return_single=False):
     return out
 
 
-def _match_annot(info, **kwargs):
+def _object_array(values):
     """
-    Match datasets in `info` to relevant keys.
+    Return `values` as a 1D object array without unpacking any elements.
 
     Parameters
     ----------
-    info : list-of-dict
-        Information on annotations
+    values : list
+        Values to store in array
+
+    Returns
+    -------
+    arr : (N,) numpy.ndarray
+        Object array of `values`
+    """
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = values
+    return arr
+
+
+def _isin(arr, values):
+    """
+    Test whether each element of object array `arr` is in `values`.
+
+    Unlike :func:`numpy.isin` this never sorts `arr`, so it is safe to use on
+    arrays that mix strings and None.
+
+    Parameters
+    ----------
+    arr : (N,) numpy.ndarray
+        Object array to test
+    values : iterable
+        Values to test against
+
+    Returns
+    -------
+    mask : (N,) numpy.ndarray
+        Boolean array where True indicates the element of `arr` is in `values`
+    """
+    mask = np.zeros(len(arr), dtype=bool)
+    for value in set(values):
+        mask |= arr == value
+    return mask
+
+
+@functools.lru_cache(maxsize=2)
+def _annot_table(return_restricted):
+    """
+    Return annotation info in columnar form, with one array per field.
+
+    The table is built once per value of `return_restricted` and cached.
+
+    Parameters
+    ----------
+    return_restricted : bool
+        Whether to include restricted annotations
+
+    Returns
+    -------
+    table : _AnnotTable
+        Named tuple of (N,) object arrays, where N is the number of entries in
+        ``get_dataset_info('annotations', return_restricted)``. The 'tags'
+        field holds frozensets (or None) and the 'denres' field holds
+        whichever of 'den' or 'res' is set for each annotation. The 'exact'
+        field is instead a dict mapping (source, desc, space, denres) tuples
+        to the indices of the matching entries
+    """
+    info = get_dataset_info('annotations', return_restricted)
+    columns = {
+        key: _object_array([dset.get(key) for dset in info])
+        for key in _AnnotTable._fields
+        if key not in ('tags', 'denres', 'exact')
+    }
+    columns['tags'] = _object_array([
+        None if dset.get('tags') is None else frozenset(dset['tags'])
+        for dset in info
+    ])
+    columns['denres'] = _object_array([
+        dset.get('den') or dset.get('res') for dset in info
+    ])
+    columns['exact'] = {}
+    for n, key in enumerate(zip(columns['source'], columns['desc'],
+                                columns['space'], columns['denres'])):
+        columns['exact'].setdefault(key, []).append(n)
+
+    return _AnnotTable(**columns)
+
+
+def _match_annot(return_restricted=False, **kwargs):
+    """
+    Match available annotations to relevant keys.
+
+    Parameters
+    ----------
+    return_restricted : bool, optional
+        Whether to match restricted annotations. Default: False
     kwargs : key-value pairs
-        Values of data in `info` on which to match
+        Values of annotation info on which to match
 
     Returns
     -------
@@ -85,27 +200,36 @@ def _match_annot(info, **kwargs):
         if vals is not None:
             denres.extend(vals)
 
-    out = []
-    for dset in info:
-        match = True
-        for key in ('source', 'desc', 'space', 'hemi', 'tags', 'format'):
-            comp, value = dset.get(key), kwargs.get(key)
-            if value is None:
-                continue
-            elif value is not None and comp is None:
-                match = False
-            elif isinstance(value, str):
-                if value != 'all':
-                    match = match and comp == value
-            else:
-                func = all if key == 'tags' else any
-                match = match and func(f in comp for f in value)
-        if len(denres) > 0:
-            match = match and (dset.get('den') or dset.get('res')) in denres
-        if match:
-            out.append(dset)
+    info = get_dataset_info('annotations', return_restricted)
+    table = _annot_table(return_restricted)
+
+    # fully-specified queries (a single value for each of source, desc, space
+    # and den/res, nothing else) can be answered straight from the index
+    exact = [kwargs.get(key) for key in ('source', 'desc', 'space')]
+    if len(denres) == 1 and all(isinstance(v, str) and v != 'all'
+                                for v in exact + denres) \
+            and all(kwargs.get(key) is None
+                    for key in ('hemi', 'tags', 'format')):
+        return [info[n] for n in table.exact.get(tuple(exact + denres), [])]
+
+    mask = np.ones(len(info), dtype=bool)
+    for key in ('source', 'desc', 'space', 'hemi', 'tags', 'format'):
+        value = kwargs.get(key)
+        if value is None:
+            continue
+        col = getattr(table, key)
+        if key == 'tags':
+            value = frozenset(value)
+            mask &= np.fromiter((t is not None and value <= t for t in col),
+                                dtype=bool, count=len(col))
+        elif isinstance(value, str):
+            mask &= np.not_equal(col, None) if value == 'all' else col == value
+        else:
+            mask &= _isin(col, value)
+    if len(denres) > 0:
+        mask &= _isin(table.denres, denres)
 
-    return out
+    return [info[n] for n in np.flatnonzero(mask)]
 
 
 def _matched_to_meta_id(matched, dedup=True):
@@ -124,7 +248,7 @@ def _matched_to_meta_id(matched, dedup=True):
     meta_ids : list-of-dict
         Unique identifiers for each entry in `matched`
     """
-    meta_ids = []
+    meta_ids, seen = [], set()
     for entry in matched:
         # get unique identifier for each entry
         if entry["format"] == "volume":
@@ -134,13 +258,33 @@ def _matched_to_meta_id(matched, dedup=True):
         else:
             raise ValueError(f"Invalid format for entry: {entry}")
         if dedup:
-            if meta_id not in meta_ids:
-                meta_ids.append(meta_id)
-        else:
-            meta_ids.append(meta_id)
+            # hashable stand-in for `meta_id` so duplicates are a set lookup
+            key = (entry["format"],) + tuple(meta_id.values())
+            if key in seen:
+                continue
+            seen.add(key)
+        meta_ids.append(meta_id)
     return meta_ids
 
 
+@functools.lru_cache(maxsize=1)
+def _annot_meta_index():
+    """
+    Return lookup table of annotation metadata.
+
+    Returns
+    -------
+    meta_index : dict
+        Where keys are frozensets of the items in each metadata entry's
+        'annot' identifier and values are the metadata entries
+    """
+    meta_index = {}
+    for meta_entry in NEUROMAPS_META["annotations"]:
+        meta_index.setdefault(frozenset(meta_entry["annot"].items()),
+                              meta_entry)
+    return meta_index
+
+
 def _matched_to_meta(matched):
     """
     Get metadata for each entry in `matched`.
@@ -158,17 +302,45 @@ def _matched_to_meta(matched):
         Metadata for each entry in `matched`
     """
     meta_ids = _matched_to_meta_id(matched)
+    meta_index = _annot_meta_index()
     matched_meta = []
     for meta_id in meta_ids:
-        for meta_entry in NEUROMAPS_META["annotations"]:
-            if meta_id == meta_entry["annot"]:
-                matched_meta.append(meta_entry)
-                break
-        else:
-            raise ValueError(f"Missing metadata for {meta_id}")
+        try:
+            matched_meta.append(meta_index[frozenset(meta_id.items())])
+        except KeyError:
+            raise ValueError(f"Missing metadata for {meta_id}") from None
     return meta_ids, matched_meta
 
 
+def _fetch_annotation_file(dset, fn, session, verbose=1):
+    """
+    Download annotation `dset` to `fn`.
+
+    Parameters
+    ----------
+    dset : dict
+        Information on annotation to be downloaded
+    fn : str
+        Filepath where downloaded annotation should be saved
+    session : requests.Session
+        Session instance to use for downloading
+    verbose : int, optional
+        Modifies verbosity of download, where higher numbers mean more updates.
+        Default: 1
+    """
+    # TODO: current work-around to handle that _fetch_files() does not support
+    # session instances. hopefully a future version will and we can just use
+    # that function to handle this instead of calling _fetch_file() directly
+    dl_file = _fetch_file(dset['url'], Path(os.path.dirname(fn)),
+                          verbose=verbose, md5sum=dset['checksum'],
+                          session=session)
+    # downloads land next to `fn`, so this is almost always a plain rename
+    try:
+        os.replace(dl_file, fn)
+    except OSError:
+        shutil.move(dl_file, fn)
+
+
 def available_annotations(source=None, desc=None, space=None, den=None,
                           res=None, hemi=None, tags=None, format=None,
                           return_restricted=False):
@@ -189,14 +361,33 @@ def available_annotations(source=None, desc=None, space=None, den=None,
     datasets : list-of-str
         List of available annotations
     """
-    info = _match_annot(get_dataset_info('annotations', return_restricted),
-                        source=source, desc=desc, space=space, den=den,
-                        res=res, hemi=hemi, tags=tags, format=format)
+    info = _match_annot(bool(return_restricted), source=source, desc=desc,
+                        space=space, den=den, res=res, hemi=hemi, tags=tags,
+                        format=format)
     fnames = [dset['fname'] for dset in info]
 
     return list(_groupby_match(fnames, return_single=False).keys())
 
 
+@functools.lru_cache(maxsize=2)
+def _tags_cached(return_restricted):
+    """
+    Return sorted tuple of available tags, caching the result.
+
+    Parameters
+    ----------
+    return_restricted : bool
+        Whether to include tags from restricted annotations
+
+    Returns
+    -------
+    tags : tuple-of-str
+        Available tags
+    """
+    tags = _annot_table(return_restricted).tags
+    return tuple(sorted(set().union(*(t for t in tags if t is not None))))
+
+
 def available_tags(return_restricted=False):
     """
     Return available tags for querying annotations.
@@ -213,11 +404,7 @@ def available_tags(return_restricted=False):
     tags : list-of-str
         Available tags
     """
-    tags = set()
-    for dset in get_dataset_info('annotations', return_restricted):
-        if dset['tags'] is not None:
-            tags.update(dset['tags'])
-    return sorted(tags)
+    return list(_tags_cached(bool(return_restricted)))
 
 
 def fetch_annotation(*, source=None, desc=None, space=None, den=None, res=None,
@@ -269,29 +456,64 @@ def fetch_annotation(*, source=None, desc=None, space=None, den=None, res=None,
     token = _get_token(token=token)
     return_restricted = False if (token is None or not token) else True
     data_dir = get_data_dir(data_dir=data_dir)
-    info = _match_annot(get_dataset_info('annotations', return_restricted),
-                        source=source, desc=desc, space=space, den=den,
-                        res=res, hemi=hemi, tags=tags, format=format)
+    info = _match_annot(return_restricted, source=source, desc=desc,
+                        space=space, den=den, res=res, hemi=hemi, tags=tags,
+                        format=format)
     if verbose > 1:
         print(f'Identified {len(info)} datasets matching specified parameters')
 
     # get session for requests
     session = _get_session(token=token)
 
-    # TODO: current work-around to handle that _fetch_files() does not support
-    # session instances. hopefully a future version will and we can just use
-    # that function to handle this instead of calling _fetch_file() directly
-    data = []
+    # single pass over matched datasets to work out which need downloading
+    # and to group their filepaths by (source, desc, space, den/res). the
+    # filenames encode exactly these fields, so we can take them from `dset`
+    # rather than re-parsing filenames with MATCH afterwards
+    base = os.path.join(data_dir, 'annotations')
+    existing = {}
+    data, groups, todo = {}, [], []
     for dset in info:
-        fn = Path(data_dir) / 'annotations' / dset['rel_path'] / dset['fname']
-        if not fn.exists():
-            dl_file = _fetch_file(dset['url'], fn.parent, verbose=verbose,
-                                  md5sum=dset['checksum'], session=session)
-            shutil.move(dl_file, fn)
-        data.append(str(fn))
+        # list each annotation directory once rather than stat-ing every file
+        rel_path = dset['rel_path']
+        parent = os.path.join(base, rel_path)
+        if rel_path not in existing:
+            try:
+                with os.scandir(parent) as entries:
+                    existing[rel_path] = {entry.name for entry in entries}
+            except (FileNotFoundError, NotADirectoryError):
+                existing[rel_path] = set()
+        fn = os.path.join(parent, dset['fname'])
+        if dset['fname'] not in existing[rel_path]:
+            todo.append((dset, fn))
+
+        key = (dset['source'], dset['desc'], dset['space'],
+               dset.get('den') or dset.get('res'))
+        fns = data.get(key)
+        if fns is None:
+            data[key] = fn
+            groups.append(dset)
+        elif isinstance(fns, list):
+            fns.append(fn)
+        else:
+            data[key] = [fns, fn]
+
+    # create output directories up front, once each, rather than per-file
+    for parent in {os.path.dirname(fn) for _, fn in todo}:
+        os.makedirs(parent, exist_ok=True)
+
+    # downloads are network-bound so overlap them in a few threads, unless
+    # we're verbose enough that interleaved progress output would be a mess
+    if verbose > 1 or len(todo) <= 1:
+        for dset, fn in todo:
+            _fetch_annotation_file(dset, fn, session, verbose=verbose)
+    else:
+        Parallel(n_jobs=min(8, len(todo)), prefer='threads')(
+            delayed(_fetch_annotation_file)(dset, fn, session, verbose=verbose)
+            for dset, fn in todo
+        )
 
-    # get meta_id for each dataset
-    meta_ids, matched_meta = _matched_to_meta(info)
+    # get meta_id for each dataset; one representative per group suffices
+    meta_ids, matched_meta = _matched_to_meta(groups)
 
     # warning for specific maps
     if verbose > 0:
@@ -312,7 +534,37 @@ def fetch_annotation(*, source=None, desc=None, space=None, den=None, res=None,
                 for bib_item in entry["refs"][bib_category]:
                     print(f"    {bib_item['citation']}")
 
-    return _groupby_match(data, return_single=return_single)
+    if return_single and len(data) == 1:
+        data = list(data.values())[0]
+
+    return data
+
+
+@functools.lru_cache(maxsize=1)
+def _annot_meta_frame():
+    """
+    Return annotation metadata as a dataframe.
+
+    The dataframe is built once and cached; callers should not modify it.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        Flattened metadata for all annotations, with additional 'annot.denres'
+        and 'annot.key' columns
+    """
+    df = pd.json_normalize(NEUROMAPS_META["annotations"])
+    den = df["annot.den"].to_numpy(dtype=object)
+    res = df["annot.res"].to_numpy(dtype=object)
+    df["annot.denres"] = np.where(pd.isna(den), res, den)
+    df["annot.key"] = list(map(tuple, np.column_stack([
+        df["annot.source"].to_numpy(dtype=object),
+        df["annot.desc"].to_numpy(dtype=object),
+        df["annot.space"].to_numpy(dtype=object),
+        df["annot.denres"].to_numpy(dtype=object)
+    ])))
+
+    return df
 
 
 def describe_annotations(annots, format="plaintext"):
@@ -344,42 +596,36 @@ def describe_annotations(annots, format="plaintext"):
     if not isinstance(annots, list):
         annots = [annots]
 
-    df_annot_info = pd.json_normalize(NEUROMAPS_META["annotations"])
-    df_annot_info["annot.denres"] = df_annot_info["annot.den"].combine_first(
-        df_annot_info["annot.res"]
-    )
-    df_annot_info["annot.key"] = list(zip(
-        df_annot_info["annot.source"],
-        df_annot_info["annot.desc"],
-        df_annot_info["annot.space"],
-        df_annot_info["annot.denres"]
-    ))
-    df_annot_info_keys_list = df_annot_info["annot.key"].tolist()
+    df_annot_info = _annot_meta_frame()
+    key_to_row = {key: n for n, key in enumerate(df_annot_info["annot.key"])}
 
     # find the annotations that are not available
-    annots_not_avail = []
-    for annot in annots:
-        if annot not in df_annot_info_keys_list:
-            annots_not_avail.append(annot)
+    annots_not_avail = [_ for _ in annots if _ not in key_to_row]
     if len(annots_not_avail) > 0:
-        raise warnings.warn(
+        warnings.warn(
             f"Annotations {annots_not_avail} are not available.",
             stacklevel=2
         )
 
-    annots_avail = [_ for _ in annots if _ not in annots_not_avail]
-    df_annot_info = \
-        df_annot_info.set_index("annot.key").loc[annots_avail, :].reset_index()
+    # select available annotations, preserving the requested order
+    df_annot_info = df_annot_info.iloc[
+        [key_to_row[_] for _ in annots if _ in key_to_row]
+    ].reset_index(drop=True)
 
     if format == "plaintext":
-        for i, row in df_annot_info.iterrows():
-            print(f"{i + 1}. {row['annot.key']} - {row['full_desc']}")
-            print(f"   N {row['demographics.N']} - Age {row['demographics.age']}")
+        rows = df_annot_info[[
+            "annot.key", "full_desc", "demographics.N", "demographics.age",
+            "refs.primary", "refs.secondary"
+        ]].itertuples(index=False, name=None)
+        for i, (key, full_desc, n, age, primary, secondary) in \
+                enumerate(rows, 1):
+            print(f"{i}. {key} - {full_desc}")
+            print(f"   N {n} - Age {age}")
             print("   Primary references:")
-            for ref in row["refs.primary"]:
+            for ref in primary:
                 print(f"      ({ref['bibkey']}) {ref['citation']}")
             print("   Secondary references:")
-            for ref in row["refs.secondary"]:
+            for ref in secondary:
                 print(f"      ({ref['bibkey']}) {ref['citation']}")
     elif format == "dataframe":
         return df_annot_info[[
@@ -395,18 +641,24 @@ def describe_annotations(annots, format="plaintext"):
                 "& full description & references "
                 "\\\\"
             )
-        for i, row in df_annot_info.iterrows():
-            refs = [
-                _['bibkey'] for _ in row["refs.primary"]
-            ] + [
-                _['bibkey'] for _ in row["refs.secondary"]
-            ]
-            refs = [_ for _ in refs if _ != ""]
+        citations = (
+            df_annot_info["refs.primary"] + df_annot_info["refs.secondary"]
+        ).map(
+            lambda refs: r"\citep{"
+            + ",".join(_["bibkey"] for _ in refs if _["bibkey"] != "")
+            + "}"
+        )
+        rows = df_annot_info[[
+            "annot.source", "annot.desc", "annot.space", "annot.denres",
+            "full_desc"
+        ]].itertuples(index=False, name=None)
+        for i, ((source, desc, space, denres, full_desc), citation) in \
+                enumerate(zip(rows, citations), 1):
             print(
-                f"{i + 1} "
-                f"& {row['annot.source']} & {row['annot.desc']} "
-                f"& {row['annot.space']} & {row['annot.denres']} "
-                rf"& {row['full_desc']} & \citep{{{','.join(refs)}}} "
+                f"{i} "
+                f"& {source} & {desc} "
+                f"& {space} & {denres} "
+                f"& {full_desc} & {citation} "
                 "\\\\"
             )
     else:
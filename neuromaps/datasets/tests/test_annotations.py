@@ -1,27 +1,77 @@
 # -*- coding: utf-8 -*-
 """For testing neuromaps.datasets.annotations functionality."""
 
+from pathlib import Path
 import pytest
 
 from neuromaps.datasets import annotations
+from neuromaps.datasets.utils import get_dataset_info
 
 
-@pytest.mark.xfail
 def test__groupby_match():
     """Test grouping by matching values."""
-    assert False
+    fnames = [
+        'source-abagen_desc-genepc1_space-fsaverage_den-10k_feature.func.gii',
+        '/data/annotations/abagen/genepc1/fsaverage/'
+        'source-abagen_desc-genepc1_space-fsaverage_den-10k_hemi-L.func.gii',
+        '/data/annotations/hcps1200/myelinmap/fsLR/'
+        'source-hcps1200_desc-myelinmap_space-fsLR_den-32k_hemi-L.func.gii',
+    ]
+    out = annotations._groupby_match(fnames)
+    assert out == {
+        ('abagen', 'genepc1', 'fsaverage', '10k'): fnames[:2],
+        ('hcps1200', 'myelinmap', 'fsLR', '32k'): fnames[2],
+    }
+    assert annotations._groupby_match(fnames[:2], return_single=True) \
+        == fnames[:2]
+    assert annotations._groupby_match([]) == {}
+    with pytest.raises(ValueError):
+        annotations._groupby_match(fnames + ['notanannotation.nii.gz'])
 
 
-@pytest.mark.xfail
 def test__match_annot():
     """Test matching annotations."""
-    assert False
+    info = get_dataset_info('annotations', return_restricted=False)
+    assert annotations._match_annot(False) == info
+    assert annotations._match_annot(False, source='all') == info
+
+    out = annotations._match_annot(False, source='abagen')
+    assert len(out) > 0 and all(d['source'] == 'abagen' for d in out)
+
+    out = annotations._match_annot(False, space=['fsLR', 'MNI152'],
+                                   den='32k', res='1mm')
+    assert len(out) > 0
+    assert all(d['space'] in ('fsLR', 'MNI152') for d in out)
+    assert all((d.get('den') or d.get('res')) in ('32k', '1mm') for d in out)
+
+    out = annotations._match_annot(False, tags=['receptors', 'PET'])
+    assert len(out) > 0
+    assert all({'receptors', 'PET'}.issubset(d['tags']) for d in out)
+
+    assert annotations._match_annot(False, source='notasource') == []
+
+    # fully-specified queries should match the general case
+    dset = info[0]
+    query = dict(source=dset['source'], desc=dset['desc'],
+                 space=dset['space'], den=dset['den'])
+    out = annotations._match_annot(False, **query)
+    assert dset in out
+    assert out == annotations._match_annot(False, **query, format='all')
+    assert annotations._match_annot(False, **dict(query, den='0k')) == []
 
 
-@pytest.mark.xfail
 def test_available_annotations():
     """Test available annotations."""
-    assert False
+    out = annotations.available_annotations(source='abagen')
+    assert len(out) > 0
+    assert all(isinstance(key, tuple) and len(key) == 4 for key in out)
+    assert all(key[0] == 'abagen' for key in out)
+    assert len(out) == len(set(out))
+
+    unrestricted = annotations.available_annotations()
+    restricted = annotations.available_annotations(return_restricted=True)
+    assert all(key in restricted for key in unrestricted)
+    assert annotations.available_annotations(source='notasource') == []
 
 
 def test_available_tags():
@@ -30,6 +80,10 @@ def test_available_tags():
     restricted = annotations.available_tags(return_restricted=True)
     assert isinstance(unrestricted, list) and isinstance(restricted, list)
     assert all(f in restricted for f in unrestricted)
+    assert unrestricted == sorted(set(unrestricted))
+    # cached results shouldn't be affected by modifying the returned list
+    unrestricted.append('notatag')
+    assert 'notatag' not in annotations.available_tags()
 
 
 def test_fetch_annotation_smoke():
@@ -37,7 +91,60 @@ def test_fetch_annotation_smoke():
     annotations.fetch_annotation(source="abagen")
 
 
-@pytest.mark.xfail
-def test_fetch_annotation():
+def test_fetch_annotation(tmp_path, monkeypatch):
     """Test fetching an annotation."""
-    assert False
+    fetched = []
+
+    def _fake_fetch_file(url, data_dir, **kwargs):
+        dl_file = Path(data_dir) / url.rsplit('/', 1)[-1]
+        dl_file.parent.mkdir(parents=True, exist_ok=True)
+        dl_file.touch()
+        fetched.append(url)
+        return dl_file
+
+    monkeypatch.setattr(annotations, '_fetch_file', _fake_fetch_file)
+    info = annotations._match_annot(False, source='hcps1200')
+    out = annotations.fetch_annotation(source='hcps1200', data_dir=tmp_path,
+                                       verbose=0)
+    assert sorted(fetched) == sorted(dset['url'] for dset in info)
+    assert len(out) == len({(d['desc'], d['space'], d.get('den'))
+                            for d in info})
+    for fns in out.values():
+        fns = [fns] if isinstance(fns, str) else fns
+        assert all(Path(fn).is_file() for fn in fns)
+
+    # files already on disk should not be downloaded again
+    fetched.clear()
+    assert annotations.fetch_annotation(source='hcps1200', data_dir=tmp_path,
+                                        verbose=0) == out
+    assert fetched == []
+
+
+def test_describe_annotations():
+    """Test describing annotations."""
+    annots = annotations.available_annotations(source='abagen')
+    annots += annotations.available_annotations(source='hcps1200')
+    annots = annots[::-1]
+    out = annotations.describe_annotations(annots, format='dataframe')
+    assert out['annot.key'].tolist() == annots
+    assert list(out.index) == list(range(len(annots)))
+
+    with pytest.warns(UserWarning, match='not available'):
+        out = annotations.describe_annotations(
+            [('notasource', 'desc', 'space', '1k'), annots[0]],
+            format='dataframe'
+        )
+    assert out['annot.key'].tolist() == [annots[0]]
+
+    with pytest.raises(ValueError):
+        annotations.describe_annotations(annots, format='notaformat')
+
+
+def test__annot_meta_frame():
+    """Test caching of annotation metadata dataframe."""
+    annotations._annot_meta_frame.cache_clear()
+    df = annotations._annot_meta_frame()
+    assert annotations._annot_meta_frame() is df
+    assert df['annot.key'].is_unique
+    assert all(len(key) == 4 for key in df['annot.key'])
+    assert df['annot.denres'].notna().all()
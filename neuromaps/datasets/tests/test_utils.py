@@ -23,10 +23,15 @@ def test__osfify_urls():
     assert False
 
 
-@pytest.mark.xfail
 def test_get_dataset_info():
     """Test getting dataset info."""
-    assert False
+    public = utils.get_dataset_info('annotations', False)
+    assert public is utils.NEUROMAPS_DATASETS_PUBLIC['annotations']
+    assert utils.get_dataset_info('annotations', False) is public
+    restricted = utils.get_dataset_info('annotations')
+    assert restricted is utils.NEUROMAPS_DATASETS['annotations']
+    with pytest.raises(KeyError):
+        utils.get_dataset_info('notadataset')
 
 
 @pytest.mark.xfail
@@ -67,12 +72,11 @@ def test_parse_fname_list():
 
 def test_parse_json():
     """Test parsing JSON files."""
-    # handling pkg_resources.resource_filename deprecation
+    # importlib.resources.files() is only available for Python >= 3.9
     if getattr(importlib.resources, 'files', None) is not None:
         osf = importlib.resources.files("neuromaps") / 'datasets/data/osf.json'
     else:
-        from pkg_resources import resource_filename
-        osf = resource_filename('neuromaps', 'datasets/data/osf.json')
+        osf = os.path.join(os.path.dirname(utils.__file__), 'data/osf.json')
 
     out = utils.parse_json(osf)
     assert isinstance(out, list) and all(isinstance(i, dict) for i in out)
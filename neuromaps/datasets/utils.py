@@ -153,12 +153,16 @@ def _load_resource_json(relative_path):
     resource_json : dict
         JSON file loaded as a dictionary
     """
-    # handling pkg_resources.resource_filename deprecation
+    # importlib.resources.files() is only available for Python >= 3.9; fall
+    # back to a path relative to the installed package rather than importing
+    # the (slow, deprecated) pkg_resources
     if getattr(importlib.resources, 'files', None) is not None:
         f_resource = importlib.resources.files("neuromaps") / relative_path
     else:
-        from pkg_resources import resource_filename
-        f_resource = resource_filename('neuromaps', relative_path)
+        f_resource = os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            relative_path
+        )
 
     with open(f_resource) as src:
         resource_json = json.load(src)